@@ -18,6 +18,7 @@ and orthology graphs from trees.
 
 import itertools
 
+import numpy as np
 import networkx as nx
 
 from tralda.datastructures.Tree import Tree, TreeNode
@@ -230,11 +231,10 @@ def informative_triples(graph, color_dict=None):
     
     R = []
     
-    for c1, c2 in itertools.permutations(color_dict.keys(), 2):
-        for a in color_dict[c1]:
-            for b1, b2 in itertools.permutations(color_dict[c2], 2):
-                if graph.has_edge(a, b1) and (not graph.has_edge(a, b2)):
-                    R.append( (a, b1, b2) )
+    for a_nodes, b_nodes, A in _color_adjacency(graph, color_dict):
+        for a, row in zip(a_nodes, A):
+            N_a, not_N_a = _split_row(b_nodes, row)
+            R.extend((a, b1, b2) for b1, b2 in itertools.product(N_a, not_N_a))
     
     return R
 
@@ -273,12 +273,10 @@ def forbidden_triples(graph, color_dict=None):
     
     F = []
     
-    for c1, c2 in itertools.permutations(color_dict.keys(), 2):
-        for a in color_dict[c1]:
-            for b1, b2 in itertools.combinations(color_dict[c2], 2):
-                if graph.has_edge(a, b1) and graph.has_edge(a, b2):
-                    F.append( (a, b1, b2) )
-                    F.append( (a, b2, b1) )
+    for a_nodes, b_nodes, A in _color_adjacency(graph, color_dict):
+        for a, row in zip(a_nodes, A):
+            N_a, _ = _split_row(b_nodes, row)
+            F.extend((a, b1, b2) for b1, b2 in itertools.permutations(N_a, 2))
     
     return F
 
@@ -318,17 +316,11 @@ def informative_forbidden_triples(graph, color_dict=None):
     
     R, F = [], []
     
-    for c1, c2 in itertools.permutations(color_dict.keys(), 2):
-        for a in color_dict[c1]:
-            for b1, b2 in itertools.combinations(color_dict[c2], 2):
-                
-                if graph.has_edge(a, b1) and graph.has_edge(a, b2):
-                    F.append( (a, b1, b2) )
-                    F.append( (a, b2, b1) )
-                elif graph.has_edge(a, b1):
-                    R.append( (a, b1, b2) )
-                elif graph.has_edge(a, b2):
-                    R.append( (a, b2, b1) )
+    for a_nodes, b_nodes, A in _color_adjacency(graph, color_dict):
+        for a, row in zip(a_nodes, A):
+            N_a, not_N_a = _split_row(b_nodes, row)
+            F.extend((a, b1, b2) for b1, b2 in itertools.permutations(N_a, 2))
+            R.extend((a, b1, b2) for b1, b2 in itertools.product(N_a, not_N_a))
     
     return R, F
 
@@ -388,6 +380,45 @@ def binary_explainable_triples(graph, color_dict=None):
     return R_binary
 
 
+def _color_adjacency(graph, color_dict):
+    """Adjacency matrices between the color classes of a colored digraph.
+    
+    Yields for each ordered pair of distinct colors (c1, c2) the node lists
+    of the two colors and the boolean adjacency matrix whose rows and columns
+    correspond to these lists.
+    """
+    
+    color_lists, position = {}, {}
+    for c, nodes_c in color_dict.items():
+        color_lists[c] = list(nodes_c)
+        for i, v in enumerate(color_lists[c]):
+            position[v] = (c, i)
+    
+    # group the arcs by color pair instead of building a |V| x |V| matrix
+    arcs = {}
+    for u, v in graph.edges():
+        c1, i = position[u]
+        c2, j = position[v]
+        if c1 != c2:
+            rows, cols = arcs.setdefault((c1, c2), ([], []))
+            rows.append(i)
+            cols.append(j)
+    
+    for c1, c2 in itertools.permutations(color_lists.keys(), 2):
+        A = np.zeros((len(color_lists[c1]), len(color_lists[c2])), dtype=bool)
+        if (c1, c2) in arcs:
+            rows, cols = arcs[c1, c2]
+            A[rows, cols] = True
+        yield color_lists[c1], color_lists[c2], A
+        
+
+def _split_row(b_nodes, row):
+    """Split nodes into out-neighbors and non-out-neighbors by a matrix row."""
+    
+    return ([b_nodes[k] for k in np.flatnonzero(row)],
+            [b_nodes[k] for k in np.flatnonzero(~row)])
+
+
 def _finalize(tree, G):
     
     if not tree:
@@ -431,82 +462,99 @@ def lrt_from_tree(T):
     doi: 10.1007/s00285-021-01564-8.
     """
     
-    lrt = T.copy()
-    if not lrt.root:
-        return lrt
-    
-    # remove planted root if existent
-    if len(lrt.root.children) == 1:
-        new_root = lrt.root.children[0]
-        new_root.detach()
-        lrt.root = new_root
-        new_root.dist = 0.0
-    
-    # assign list of leaves to each node
-    leaves = lrt.leaf_dict()
-    
-    subtree_reconcs = {}
-    for v in lrt.preorder():
-        subtree_reconcs[v] = {leaf.reconc for leaf in leaves[v]}
+    if not T.root:
+        return T.copy()
+    
+    # ignore planted root if existent
+    if len(T.root.children) == 1:
+        T = Tree(T.root.children[0])
+    
+    # color sets as bitmasks (one bit per color)
+    color_bit = {}
+    subtree_colors = {}
+    for v in T.postorder():
+        if not v.children:
+            if v.reconc not in color_bit:
+                color_bit[v.reconc] = 1 << len(color_bit)
+            subtree_colors[v] = color_bit[v.reconc]
+        else:
+            subtree_colors[v] = 0
+            for child in v.children:
+                subtree_colors[v] |= subtree_colors[child]
         
-    arc_colors = _arc_colors(lrt, leaves, subtree_reconcs)
-    red_edges = redundant_edges(lrt, subtree_reconcs, arc_colors)
-    lrt.contract(red_edges)
-    lrt = topology_only(lrt)
+    arc_colors = _arc_colors(T, subtree_colors, color_bit)
+    contracted = {v for _, v in redundant_edges(T, subtree_colors, arc_colors)}
+    
+    # copy the tree without the contracted nodes, their children are attached
+    # to the copy of the nearest non-contracted ancestor (in sibling order)
+    mapping = {}
+    for v in T.preorder():
+        if v in contracted:
+            mapping[v] = mapping[v.parent]
+            continue
+        mapping[v] = TreeNode(**{key: value for key, value in v.attributes()})
+        if v is not T.root:
+            mapping[v.parent].add_child(mapping[v])
     
-    return lrt
+    return topology_only(Tree(mapping[T.root]))
 
 
-def _arc_colors(T, leaves, subtree_reconcs):
+def _arc_colors(T, subtree_colors, color_bit):
     """Color sets relevant for redundant edge computation.
     
     Computes for all inner vertices v the color set of y such that y with (x,y)
-    is an arc in the BMG and lca(x,y) = v.
+    is an arc in the BMG and lca(x,y) = v. All color sets are represented as
+    bitmasks.
     """
     
-    all_colors = subtree_reconcs[T.root]
+    all_colors = subtree_colors[T.root]
     
     # color sets for all v
-    arc_colors = {v: set() for v in T.preorder()}
+    arc_colors = {v: 0 for v in subtree_colors}
     
-    for u in leaves[T.root]:
+    for u in T.leaves():
         
         # colors to which no best match has yet been found
-        remaining = all_colors - {u.reconc}
+        remaining = all_colors & ~color_bit[u.reconc]
         
         # start with direct parent of each node
         current = u.parent
         
         while remaining and current:
-            colors_here = set()
-            for v in leaves[current]:
-                
-                # best match found
-                if v.reconc in remaining:
-                    colors_here.add(v.reconc)
             
-            arc_colors[current].update(colors_here)
-            remaining -= colors_here
+            # best matches found
+            colors_here = subtree_colors[current] & remaining
+            
+            arc_colors[current] |= colors_here
+            remaining &= ~colors_here
             current = current.parent
     
     return arc_colors
 
 
-def redundant_edges(T, subtree_reconcs, arc_colors):
+def redundant_edges(T, subtree_colors, arc_colors):
+    """Redundant inner edges w.r.t. best matches.
+    
+    The color sets of the subtrees and the arc colors are bitmasks.
+    """
     
     red_edges = []
     
-    for u, v in T.inner_edges():
+    for u in T.preorder():
         
-        # colors s in sigma( L(T(u) \ T(v)) )
-        aux_set = set()
+        children = list(u.children)
         
-        for v2 in u.children:
-            if v2 is not v:
-                aux_set.update(subtree_reconcs[v2])
+        # colors s in sigma( L(T(u) \ T(v)) ) as union of the colors of the
+        # preceding and the succeeding siblings of v
+        suffix = [0] * (len(children) + 1)
+        for k in range(len(children)-1, -1, -1):
+            suffix[k] = suffix[k+1] | subtree_colors[children[k]]
         
-        if not arc_colors[v].intersection(aux_set):
-            red_edges.append((u, v))
+        prefix = 0
+        for k, v in enumerate(children):
+            if v.children and not arc_colors[v] & (prefix | suffix[k+1]):
+                red_edges.append((u, v))
+            prefix |= subtree_colors[v]
     
     return red_edges
 
@@ -647,6 +695,19 @@ class TwoColoredLRT:
             
         self.digraph = digraph
         self.color_dict = sort_by_colors(digraph)
+        
+        # node attributes and arcs as arrays indexed by node id
+        self._nodes = list(digraph.nodes())
+        index = {v: i for i, v in enumerate(self._nodes)}
+        color_index = {c: i for i, c in enumerate(self.color_dict)}
+        self._color = np.fromiter((color_index[digraph.nodes[v]['color']]
+                                   for v in self._nodes),
+                                  dtype=np.int32, count=len(self._nodes))
+        
+        self._tails = np.fromiter((index[u] for u, _ in digraph.edges()),
+                                  dtype=np.intp, count=digraph.size())
+        self._heads = np.fromiter((index[v] for _, v in digraph.edges()),
+                                  dtype=np.intp, count=digraph.size())
                 
     
     def build_tree(self):
@@ -672,11 +733,12 @@ class TwoColoredLRT:
         # 2 colors
         else:
             subtrees = []
-            for wcc in nx.weakly_connected_components(self.digraph):
-                if len(wcc) == 1:
+            for wcc in self._wccs(np.arange(len(self._nodes)),
+                                  self._tails, self._heads):
+                if len(wcc[0]) == 1:
                     return False
                 
-                subroot = self._build_tree(self.digraph.subgraph(wcc).copy())
+                subroot = self._build_tree(*wcc)
                 
                 if not subroot:
                     return False
@@ -693,33 +755,44 @@ class TwoColoredLRT:
         return _finalize(root, self.digraph)
     
         
-    def _build_tree(self, G):
-            
-        color_count = {c: 0 for c in self.color_dict.keys()}
-        for v in G.nodes():
-            color_count[G.nodes[v]['color']] += 1
-        other_color = {color: G.order() - count
-                       for color, count in color_count.items()}
+    def _build_tree(self, idx, tails, heads):
+        """Recursive construction for a weakly connected component.
+        
+        The component is given by the node ids `idx` and its arcs, the arcs
+        refer to positions in `idx`.
+        """
+        
+        n = len(idx)
+        color = self._color[idx]
+        other_color = n - np.bincount(color, minlength=len(self.color_dict))
+        out_degree = np.bincount(tails, minlength=n)
+        
+        umbrella = other_color[color] == out_degree
         
-        umbrella = {v for v in G.nodes() if 
-                    other_color[G.nodes[v]['color']] == G.out_degree(v)}
-        S_1 = {v for v in umbrella if umbrella.issuperset(G.predecessors(v))}
-        S_2 = {v for v in S_1 if S_1.issuperset(G.predecessors(v))}
+        # all predecessors must lie in the umbrella resp. in S_1
+        S_1 = umbrella & (np.bincount(heads[~umbrella[tails]],
+                                      minlength=n) == 0)
+        S_2 = S_1 & (np.bincount(heads[~S_1[tails]], minlength=n) == 0)
         
-        if not S_2 or len(S_1) != len(S_2):
+        if not np.any(S_2) or np.count_nonzero(S_1) != np.count_nonzero(S_2):
             return False
             
         node = TreeNode()
-        for v in S_2:
-            node.add_child(TreeNode(label=v))
-            G.remove_node(v)
+        for i in idx[S_2]:
+            node.add_child(TreeNode(label=self._nodes[i]))
         
-        for wcc in nx.weakly_connected_components(G):
+        # remove S_2 and renumber the remaining nodes
+        keep = ~S_2
+        position = np.cumsum(keep) - 1
+        arcs = keep[tails] & keep[heads]
+        
+        for wcc in self._wccs(idx[keep], position[tails[arcs]],
+                              position[heads[arcs]]):
             
-            if len(wcc) == 1:
+            if len(wcc[0]) == 1:
                 return False
             
-            child = self._build_tree(G.subgraph(wcc).copy())
+            child = self._build_tree(*wcc)
             
             if not child:
                 return False
@@ -728,6 +801,55 @@ class TwoColoredLRT:
                 
         return node
     
+    
+    @staticmethod
+    def _wccs(idx, tails, heads):
+        """Weakly connected components by union-find with path halving.
+        
+        Returns a list of triples (node ids, tails, heads) in the same format
+        as the input, i.e. the arcs refer to positions within the component.
+        """
+        
+        n = len(idx)
+        parent = list(range(n))
+        
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+        
+        for u, v in zip(tails.tolist(), heads.tolist()):
+            root_u, root_v = find(u), find(v)
+            if root_u != root_v:
+                parent[root_u] = root_v
+        
+        roots = np.fromiter((find(x) for x in range(n)), dtype=np.intp,
+                            count=n)
+        _, labels = np.unique(roots, return_inverse=True)
+        
+        # group nodes and arcs by component and renumber within components
+        counts = np.bincount(labels)
+        starts = np.cumsum(counts) - counts
+        node_order = np.argsort(labels, kind='stable')
+        position = np.empty(n, dtype=np.intp)
+        position[node_order] = np.arange(n) - np.repeat(starts, counts)
+        
+        arc_labels = labels[tails]
+        arc_counts = np.bincount(arc_labels, minlength=len(counts))
+        arc_starts = np.cumsum(arc_counts) - arc_counts
+        arc_order = np.argsort(arc_labels, kind='stable')
+        
+        result = []
+        for c in range(len(counts)):
+            nodes_c = node_order[starts[c]:starts[c]+counts[c]]
+            arcs_c = arc_order[arc_starts[c]:arc_starts[c]+arc_counts[c]]
+            result.append((idx[nodes_c],
+                           position[tails[arcs_c]],
+                           position[heads[arcs_c]]))
+        
+        return result
+    
 
 def lrt_from_2bmg(G):
     """Effieciently constructs the LRT for a 2-BMG via the support vertices.
@@ -9,16 +9,112 @@ disturbing the distances specified by a given tree directly. This module
 implements functions for the latter alternative.
 """
 
-import random
+import random, multiprocessing, threading
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
-from tralda.datastructures.Tree import Tree, TreeNode
-from asymmetree.tools.PhyloTreeTools import distance_matrix
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
 __author__ = "David Schaller"
 
 
+# --------------------------------------------------------------------------
+#                        METRIC REPAIR KERNELS
+#
+#   (compiled with numba if available, otherwise pure Python/NumPy)
+# --------------------------------------------------------------------------
+
+if numba is not None:
+    # the serial kernels release the GIL, i.e. several matrices can be
+    # repaired concurrently in threads (the thread-parallel kernel must not
+    # be launched concurrently and is only used from the main thread)
+    _jit = numba.njit(nogil=True, fastmath=True, cache=True)
+    _jit_parallel = numba.njit(parallel=True, nogil=True, fastmath=True,
+                               cache=True)
+    _prange = numba.prange
+else:
+    _jit = _jit_parallel = None
+    _prange = range
+
+
+def _fw_domr(D):
+    """Decrease only metric repair (DOMR) with Floyd-Warshall in place."""
+    
+    N = D.shape[0]
+    for k in range(N):
+        for i in range(N):
+            d_ik = D[i,k]
+            for j in range(N):
+                s = d_ik + D[k,j]
+                if D[i,j] > s:
+                    D[i,j] = s
+
+
+def _fw_domr_parallel(D):
+    """Decrease only metric repair (DOMR) with Floyd-Warshall in place.
+    
+    Each thread only writes to its own row i, rows k and column k are not
+    altered in iteration k since D[k,k] = 0.
+    """
+    
+    N = D.shape[0]
+    for k in range(N):
+        for i in _prange(N):
+            d_ik = D[i,k]
+            for j in range(N):
+                s = d_ik + D[k,j]
+                if D[i,j] > s:
+                    D[i,j] = s
+
+
+def _general_repair_count(D, l, r):
+    """Count the triangle violations for the general metric repair."""
+    
+    N = D.shape[0]
+    for k in range(N):
+        for i in range(N):
+            for j in range(i):
+                if D[i,j] >= D[i,k] + D[k,j]:
+                    l[i,j] += 1
+                    r[i,k] += 1
+                    r[j,k] += 1
+
+
+def _general_repair_update(D, l, r):
+    """Repair the triangle violations for the general metric repair."""
+    
+    N = D.shape[0]
+    for k in range(N):
+        for i in range(N):
+            for j in range(i):
+                if D[i,j] >= D[i,k] + D[k,j]:
+                    if l[i,j] > max(r[i,k], r[j,k]):
+                        D[i,j] = D[i,k] + D[k,j]
+                        D[j,i] = D[i,k] + D[k,j]
+                    elif r[i,k] > r[j,k]:
+                        D[i,k] = D[i,j] - D[j,k]
+                        D[k,i] = D[i,j] - D[j,k]
+                    else:
+                        D[j,k] = D[i,j] - D[i,k]
+                        D[k,j] = D[i,j] - D[i,k]
+
+
+if numba is not None:
+    # the counting and update passes write to entries of other rows and
+    # hence are compiled without thread parallelism; the serial and the
+    # parallel DOMR kernel are separate functions so that they do not share
+    # an entry in the on-disk cache
+    _fw_domr = _jit(_fw_domr)
+    _fw_domr_parallel = _jit_parallel(_fw_domr_parallel)
+    _general_repair_count = _jit(_general_repair_count)
+    _general_repair_update = _jit(_general_repair_update)
+
+
 # --------------------------------------------------------------------------
 #                      RANDOM PERTURBATION NOISE
 #   
@@ -70,34 +166,123 @@ def noisy_matrix(orig_matrix, sd, metric_repair='reject'):
         raise ValueError("illegal argument '{}'".format(metric_repair))
 
     
+def noisy_matrix_batch(orig_matrix, sds, n_replicates=1,
+                       metric_repair='reject', workers=None):
+    """Disturbed replicates of a distance matrix computed in parallel.
+    
+    Each replicate is computed by the function `noisy_matrix` in a separate
+    process. The processes are started with the 'spawn' method, i.e. scripts
+    calling this function must be guarded by `if __name__ == '__main__'`.
+    
+    Parameters
+    ----------
+    orig_matrix : 2-dimensional numpy array
+        The distance matrix.
+    sds : list of float
+        Disturbance parameters, see function `noisy_matrix`.
+    n_replicates : int, optional
+        Number of disturbed matrices per disturbance parameter. The default
+        is 1.
+    metric_repair : str, optional
+        Strategy to ensure that the resulting matrices are still metrics, see
+        function `noisy_matrix`. The default is 'reject'.
+    workers : int, optional
+        The maximal number of processes. The default is None, in which case
+        the number of processors of the machine is used.
+    
+    Returns
+    -------
+    list of lists of 2-dim. numpy arrays
+        The disturbed distance matrices for each disturbance parameter (in
+        the order of `sds`).
+    """
+    
+    # draw seeds in the parent process such that the replicates are
+    # independent (and reproducible with numpy.random.seed)
+    seeds = np.random.randint(2**32, size=(len(sds), n_replicates),
+                              dtype=np.uint64)
+    
+    # 'spawn' since forking after numba has started its worker threads may
+    # deadlock the child processes or the interpreter at exit
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn')
+                             ) as executor:
+        futures = [[executor.submit(_seeded_noisy_matrix, orig_matrix, sd,
+                                    metric_repair, int(seed))
+                    for seed in seeds_sd]
+                   for sd, seeds_sd in zip(sds, seeds)]
+        
+        return [[future.result() for future in futures_sd]
+                for futures_sd in futures]
+
+
+def _seeded_noisy_matrix(orig_matrix, sd, metric_repair, seed):
+    """Worker function for noisy_matrix_batch."""
+    
+    np.random.seed(seed)
+    return noisy_matrix(orig_matrix, sd, metric_repair=metric_repair)
+    
+    
+def _multiplicative_noise(D, sd):
+    """Disturb the off-diagonal entries of a symmetric matrix in place.
+    
+    One normally distributed factor is drawn per pair i < j, non-positive
+    factors are redrawn.
+    """
+    
+    upper = np.triu_indices(D.shape[0], 1)
+    factors = np.random.normal(loc=1.0, scale=sd, size=len(upper[0]))
+    mask = factors <= 0.0
+    while np.any(mask):
+        factors[mask] = np.random.normal(loc=1.0, scale=sd,
+                                         size=np.count_nonzero(mask))
+        mask = factors <= 0.0
+    
+    D[upper] *= factors
+    D.T[upper] = D[upper]
+    
+    
 def _noise_reject_method(orig_matrix, sd):
-    """Return a matrix D' with noise by accept/reject algorithm."""
+    """Return a matrix D' with noise by accept/reject algorithm.
+    
+    In each round, new distances are proposed for the pairs of a random
+    matching, i.e. the pairs are disjoint. Then every triangle contains at
+    most one of the changed pairs and all proposals can be checked at once.
+    """
     
-    D = np.array(orig_matrix, copy=True)
+    D = np.array(orig_matrix, dtype=np.float64, copy=True)
     N = D.shape[0]
+    K = N // 2
     
     success_count = 0
-    stop_at = N * (N-1) / 2
+    stop_at = N * (N-1) // 2
     
     while success_count < stop_at:
-        i, j = np.random.randint(N, size=2)
-        while i == j:
-            j = np.random.randint(N)
-        old_distance = D[i,j].copy()
-        new_distance = 0.0
-        while new_distance <= 0.0:
-            new_distance = D[i,j] * np.random.normal(loc=1.0, scale=sd)
-        D[i,j] = new_distance
-        D[j,i] = new_distance
         
+        pairs = np.random.permutation(N)[:2*K].reshape(K, 2)
+        I, J = pairs[:,0], pairs[:,1]
+        rows = np.arange(K)
         
-        if (D[i,j] > np.min(D[i,:] + D[:,j]) or
-            np.any( D[:,i] > D[:,j] + D[j,i] ) or
-            np.any( D[:,j] > D[:,i] + D[i,j] )):
-            D[i,j] = old_distance
-            D[j,i] = old_distance
-        else:
-            success_count += 1
+        # non-positive factors are rejected (equivalent to redrawing them)
+        factors = np.random.normal(loc=1.0, scale=sd, size=K)
+        new_distances = D[I,J] * factors
+        
+        # only the triangles (i,j,k) with k != i,j are affected, the
+        # upper bound is min D[i,k] + D[k,j] and the lower bound is
+        # max |D[i,k] - D[k,j]| (D is symmetric)
+        upper = D[I,:] + D[J,:]
+        upper[rows,I] = upper[rows,J] = np.inf
+        lower = np.abs(D[I,:] - D[J,:])
+        lower[rows,I] = lower[rows,J] = 0.0
+        
+        accepted = np.flatnonzero((factors > 0.0) &
+                                  (new_distances <= upper.min(axis=1)) &
+                                  (new_distances >= lower.max(axis=1)))
+        accepted = accepted[:stop_at-success_count]
+        
+        D[I[accepted],J[accepted]] = new_distances[accepted]
+        D[J[accepted],I[accepted]] = new_distances[accepted]
+        success_count += len(accepted)
     
     return D
 
@@ -105,23 +290,19 @@ def _noise_reject_method(orig_matrix, sd):
 def _noise_metric_repair_DOMR(orig_matrix, sd):
     """Return a matrix D' with noise by metric repair (DOMR) algorithm."""
     
-    D = np.array(orig_matrix, copy=True)
+    D = np.array(orig_matrix, dtype=np.float64, copy=True)
     N = D.shape[0]
     
-    for i in range(N-1):                        # noise introduction
-        for j in range(i+1, N):
-            new_distance = 0.0
-            while new_distance <= 0.0:
-                new_distance = D[i,j] * np.random.normal(loc=1.0, scale=sd)
-            D[i,j] = new_distance
-            D[j,i] = new_distance
-    
-    for k in range(N):                          # metric repair: decrease
-        for i in range(N):                      # only metric repair (DOMR)
-            for j in range(i):                  # with Floyd-Warshall
-                if D[i,j] >= D[i,k] + D[k,j]:
-                    D[i,j] = D[i,k] + D[k,j]
-                    D[j,i] = D[i,k] + D[k,j]
+    _multiplicative_noise(D, sd)                # noise introduction
+    
+    if numba is not None:                       # metric repair: decrease
+        if threading.current_thread() is threading.main_thread():
+            _fw_domr_parallel(D)                # only metric repair (DOMR)
+        else:                                   # with Floyd-Warshall
+            _fw_domr(D)
+    else:
+        for k in range(N):
+            np.minimum(D, D[:,k,None] + D[None,k,:], out=D)
     
     return D
 
@@ -129,38 +310,24 @@ def _noise_metric_repair_DOMR(orig_matrix, sd):
 def _noise_general_metric_repair(orig_matrix, sd):
     """Return a matrix D' with noise by metric repair (DOMR) algorithm."""
     
-    D = np.array(orig_matrix, copy=True)
+    D = np.array(orig_matrix, dtype=np.float64, copy=True)
     N = D.shape[0]
     
-    for i in range(N-1):                        # noise introduction
-        for j in range(i+1,N):
-            new_distance = 0.0
-            while new_distance <= 0.0:
-                new_distance = D[i,j] * np.random.normal(loc=1.0, scale=sd)
-            D[i,j] = new_distance
-            D[j,i] = new_distance
+    _multiplicative_noise(D, sd)                # noise introduction
             
-    l, r = np.zeros_like(D), np.zeros_like(D)
-    for k in range(N):                          # metric repair: general metric repair
-        for i in range(N):
-            for j in range(i):
-                if D[i,j] >= D[i,k] + D[k,j]:
-                    l[i,j] += 1
-                    r[i,k] += 1
-                    r[j,k] += 1
-    for k in range(N):                          # metric repair: general metric repair
-        for i in range(N):
-            for j in range(i):
-                if D[i,j] >= D[i,k] + D[k,j]:
-                    if l[i,j] > max(r[i,k], r[j,k]):
-                        D[i,j] = D[i,k] + D[k,j]
-                        D[j,i] = D[i,k] + D[k,j]
-                    elif r[i,k] > r[j,k]:
-                        D[i,k] = D[i,j] - D[j,k]
-                        D[k,i] = D[i,j] - D[j,k]
-                    else:
-                        D[j,k] = D[i,j] - D[i,k]
-                        D[k,j] = D[i,j] - D[i,k]
+    l = np.zeros((N, N), dtype=np.int32)        # metric repair: general
+    r = np.zeros((N, N), dtype=np.int32)        # metric repair
+    
+    if numba is not None:
+        _general_repair_count(D, l, r)
+    else:
+        for k in range(N):
+            # violations of D[i,j] <= D[i,k] + D[k,j] for j < i
+            violated = np.tril(D >= D[:,k,None] + D[None,k,:], -1)
+            l += violated
+            r[:,k] += violated.sum(axis=1) + violated.sum(axis=0)
+    
+    _general_repair_update(D, l, r)
     
     return D
 
@@ -214,17 +381,7 @@ def convex_linear_comb(D1, D2, alpha=0.05, first_only=False):
         
         N1, N2 = D1.shape[0], D2.shape[0]
         D1_alpha = (1-alpha) * D1 + alpha * D2[:N1,:N1]
-        D2_alpha = (1-alpha) * D2
-        
-        for i in range(N2 // N1):
-            for j in range(N2 // N1):
-                D2_alpha[i*N1:i*N1+N1, j*N1:j*N1+N1] += alpha * D1
-                if i == (N2 // N1) - 1 and i == j:
-                    D2_alpha[i*N1+N1:N2, j*N1+N1:N2] += alpha * D1[:(N2%N1), :(N2%N1)]
-                if i == (N2 // N1) - 1:
-                    D2_alpha[i*N1+N1:N2, j*N1:j*N1+N1] += alpha * D1[:(N2%N1), :]
-                if j == (N2 // N1) - 1:
-                    D2_alpha[i*N1:i*N1+N1, j*N1+N1:N2] += alpha * D1[:, :(N2%N1)]
+        D2_alpha = (1-alpha) * D2 + alpha * _tile_matrix(D1, N2)
         
         if swap:
             return D2_alpha, D1_alpha
@@ -239,17 +396,14 @@ def convex_linear_comb(D1, D2, alpha=0.05, first_only=False):
         if N1 < N2:
             return (1-alpha) * D1 + alpha * D2[:N1,:N1]
         else:
-            D1_alpha = (1-alpha) * D1
-            for i in range(N1 // N2):
-                for j in range(N1 // N2):
-                    D1_alpha[i*N2:i*N2+N2, j*N2:j*N2+N2] += alpha * D2
-                    if i == (N1 // N2) - 1 and i == j:
-                        D1_alpha[i*N2+N2:N1, j*N2+N2:N1] += alpha * D2[:(N1%N2), :(N1%N2)]
-                    if i == (N1 // N2) - 1:
-                        D1_alpha[i*N2+N2:N1, j*N2:j*N2+N2] += alpha * D2[:(N1%N2), :]
-                    if j == (N1 // N2) - 1:
-                        D1_alpha[i*N2:i*N2+N2, j*N2+N2:N1] += alpha * D2[:, :(N1%N2)]
-            return D1_alpha
+            return (1-alpha) * D1 + alpha * _tile_matrix(D2, N1)
+
+
+def _tile_matrix(D, N):
+    """Repeat a (smaller) square matrix to fill an N x N matrix."""
+    
+    reps = -(-N // D.shape[0])                  # ceiling division
+    return np.tile(D, (reps, reps))[:N,:N]
 
 
 def wrong_topology_matrix(PGT):
@@ -261,25 +415,54 @@ def wrong_topology_matrix(PGT):
         return                                          # hence |E| should be even
     random.shuffle(distances)
     
-    random_tree = Tree(TreeNode(label=0, dist=0.0))
+    # random tree as arrays, children always have larger ids than parents
+    n_nodes = len(distances) + 1
+    children = np.full((n_nodes, 2), -1, dtype=np.intp)
+    dist = np.zeros(n_nodes)
     id_counter = 1
-    current_leaves = [random_tree.root]
+    current_leaves = [0]
     
     while distances:
         v = current_leaves.pop(random.randint(0, len(current_leaves)-1))
-        dist1, dist2 = distances.pop(), distances.pop()
-        new_child1 = TreeNode(label=id_counter, dist=dist1)
-        new_child2 = TreeNode(label=id_counter+1, dist=dist2)
-        v.add_child(new_child1)
-        v.add_child(new_child2)
-        current_leaves.extend(v.children)
-        id_counter += 1
-    
-    random_leaves = [l for l in random_tree.leaves()]   # implicit random bijection
+        children[v] = id_counter, id_counter + 1
+        dist[id_counter], dist[id_counter+1] = distances.pop(), distances.pop()
+        current_leaves.extend((id_counter, id_counter + 1))
+        id_counter += 2
+    
+    inner = np.flatnonzero(children[:,0] >= 0)
+    root_dist = np.zeros(n_nodes)
+    for v in inner:
+        root_dist[children[v]] = root_dist[v] + dist[children[v]]
+    
+    # leaves in sibling order, the leaves below each node form a range
+    leaves, preorder, stack = [], [], [0]
+    start = np.zeros(n_nodes, dtype=np.intp)
+    end = np.zeros(n_nodes, dtype=np.intp)
+    while stack:
+        v = stack.pop()
+        preorder.append(v)
+        if children[v,0] < 0:
+            start[v], end[v] = len(leaves), len(leaves) + 1
+            leaves.append(v)
+        else:
+            stack.extend((children[v,1], children[v,0]))
+    for v in reversed(preorder):
+        if children[v,0] >= 0:
+            start[v], end[v] = start[children[v,0]], end[children[v,1]]
+    
+    leaf_dist = root_dist[leaves]
+    D = np.zeros((len(leaves), len(leaves)))
+    for v in inner:
+        s1 = slice(start[children[v,0]], end[children[v,0]])
+        s2 = slice(start[children[v,1]], end[children[v,1]])
+        block = leaf_dist[s1,None] + leaf_dist[None,s2] - 2 * root_dist[v]
+        D[s1,s2] = block
+        D[s2,s1] = block.T
+    
+    random_leaves = list(range(len(leaves)))            # implicit random bijection
     random.shuffle(random_leaves)                       # to original tree
     
-    _, D = distance_matrix(random_tree, leaf_order=random_leaves)
-    return D
+    return D[np.ix_(random_leaves, random_leaves)]
 
 
 # --------------------------------------------------------------------------
@@ -291,17 +474,25 @@ def _check_metric(matrix):
     """Check whether a given matrix is a metric."""
     
     N = matrix.shape[0]
-    for i in range(N):
-        if matrix[i,i] != 0.0:
-            print("Not all diagonal elements zero!")
-            return False
-    for i in range(N-1):
-        for j in range(i+1,N):
-            if matrix[i,j] != matrix[j,i]:
-                print("Not symmetrical for",i,j)
-                return False
-            if abs(matrix[i,j] - np.min(matrix[i,:] + matrix[:,j])) > 1e-8:
-                print("Violation of triangle inequality!",
-                      i, j, np.min(matrix[i,:] + matrix[:,j]), matrix[i,j])
-                return False
-    return True
\ No newline at end of file
+    if np.any(np.diag(matrix) != 0.0):
+        print("Not all diagonal elements zero!")
+        return False
+    
+    asymmetric = np.argwhere(matrix != matrix.T)
+    if len(asymmetric) > 0:
+        print("Not symmetrical for", *asymmetric[0])
+        return False
+    
+    # shortest paths of length 2, i.e. min_k matrix[i,k] + matrix[k,j]
+    min_path = np.full(matrix.shape, np.inf)
+    for k in range(N):
+        np.minimum(min_path, matrix[:,k,None] + matrix[None,k,:],
+                   out=min_path)
+    
+    violations = np.argwhere(np.abs(matrix - min_path) > 1e-8)
+    if len(violations) > 0:
+        i, j = violations[0]
+        print("Violation of triangle inequality!",
+              i, j, min_path[i,j], matrix[i,j])
+        return False
+    return True
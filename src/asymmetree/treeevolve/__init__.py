@@ -33,5 +33,6 @@ from asymmetree.treeevolve.RateHeterogeneity import (rate_heterogeneity,
                                                      autocorrelation_factors,
                                                      gene_trees)
 from asymmetree.treeevolve.DistanceNoise import (noisy_matrix,
+                                                 noisy_matrix_batch,
                                                  convex_linear_comb,
                                                  wrong_topology_matrix)
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 
-import unittest
+import unittest, itertools
+
+from tralda.tools.GraphTools import sort_by_colors
 
 import asymmetree.analysis as analysis
+from asymmetree.analysis.BestMatches import (informative_triples,
+                                             forbidden_triples,
+                                             informative_forbidden_triples,
+                                             lrt_from_2bmg)
 
 from asymmetree.tools.PhyloTreeTools import random_colored_tree
 
@@ -27,6 +33,54 @@ class TestBMG(unittest.TestCase):
             lrt2 = analysis.lrt_from_colored_graph(bmg, mincut=False)
             
             self.assertTrue( lrt1.equal_topology(lrt2) )
+
+    
+    def test_triples(self):
+        
+        N, colors = 30, 4
+        repeats = 5
+        
+        for _ in range(repeats):
+            
+            tree = random_colored_tree(N, colors)
+            bmg = analysis.bmg_from_tree(tree)
+            
+            R1, F1 = informative_forbidden_triples(bmg)
+            R2 = informative_triples(bmg)
+            F2 = forbidden_triples(bmg)
+            
+            # brute-force reference
+            R, F = set(), set()
+            color_dict = sort_by_colors(bmg)
+            for c1, c2 in itertools.permutations(color_dict.keys(), 2):
+                for a in color_dict[c1]:
+                    for b1, b2 in itertools.permutations(color_dict[c2], 2):
+                        if bmg.has_edge(a, b1) and not bmg.has_edge(a, b2):
+                            R.add( (a, b1, b2) )
+                        elif bmg.has_edge(a, b1) and bmg.has_edge(a, b2):
+                            F.add( (a, b1, b2) )
+            
+            for R_i, F_i in ((R1, F1), (R2, F2)):
+                self.assertEqual(len(R_i), len(R))
+                self.assertEqual(set(R_i), R)
+                self.assertEqual(len(F_i), len(F))
+                self.assertEqual(set(F_i), F)
+                
+    
+    def test_2bmg(self):
+        
+        N = 30
+        repeats = 20
+        
+        for _ in range(repeats):
+            
+            tree = random_colored_tree(N, 2)
+            bmg = analysis.bmg_from_tree(tree)
+            
+            lrt1 = analysis.lrt_from_tree(tree)
+            lrt2 = lrt_from_2bmg(bmg)
+            
+            self.assertTrue( lrt1.equal_topology(lrt2) )
             
 
 if __name__ == '__main__':
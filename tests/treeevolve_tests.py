@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 import asymmetree.treeevolve as te
+import asymmetree.treeevolve.DistanceNoise as dn
+from asymmetree.treeevolve.DistanceNoise import _check_metric
+from asymmetree.tools.PhyloTreeTools import (distance_matrix,
+                                             remove_planted_root)
 
 
 __author__ = 'David Schaller'
@@ -67,6 +75,95 @@ class TestTreeEvolvePackage(unittest.TestCase):
             
             # check that there is no extinction in all species
             self.assertTrue([l for l in gene_tree2.leaves()])
+
+    
+    def test_noisy_matrix(self):
+        
+        n = 20
+        
+        species_tree = te.species_tree_n(n, model='yule')
+        _, D = distance_matrix(species_tree)
+        
+        for metric_repair in ('reject', 'DOMR', 'general'):
+            
+            D_noisy = te.noisy_matrix(D, 0.5, metric_repair=metric_repair)
+            
+            self.assertEqual(D_noisy.shape, D.shape)
+            
+            if metric_repair != 'general':
+                self.assertTrue(_check_metric(D_noisy))
+
+        batch = te.noisy_matrix_batch(D, [0.2, 0.5], n_replicates=2,
+                                      workers=2)
+        
+        self.assertEqual(len(batch), 2)
+        for replicates in batch:
+            self.assertEqual(len(replicates), 2)
+            self.assertFalse(np.array_equal(replicates[0], replicates[1]))
+            for D_noisy in replicates:
+                self.assertTrue(_check_metric(D_noisy))
+            
+    
+    def test_metric_repair_without_numba(self):
+        
+        n = 20
+        
+        species_tree = te.species_tree_n(n, model='yule')
+        _, D = distance_matrix(species_tree)
+        
+        for metric_repair in ('DOMR', 'general'):
+            
+            state = np.random.get_state()
+            D_numba = te.noisy_matrix(D, 0.5, metric_repair=metric_repair)
+            np.random.set_state(state)
+            
+            # also use the pure Python version of the compiled update pass
+            update = getattr(dn._general_repair_update, 'py_func',
+                             dn._general_repair_update)
+            with mock.patch.object(dn, 'numba', None), \
+                 mock.patch.object(dn, '_general_repair_update', update):
+                D_numpy = te.noisy_matrix(D, 0.5, metric_repair=metric_repair)
+            
+            if dn.numba is not None:
+                self.assertTrue(np.allclose(D_numba, D_numpy))
+            if metric_repair == 'DOMR':
+                self.assertTrue(_check_metric(D_numpy))
+            
+    
+    def test_threaded_metric_repair(self):
+        
+        n = 30
+        
+        species_tree = te.species_tree_n(n, model='yule')
+        _, D = distance_matrix(species_tree)
+        
+        # parallel kernel in the main thread first, then concurrent calls
+        self.assertTrue(_check_metric(te.noisy_matrix(D, 0.5, 'DOMR')))
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                lambda sd: te.noisy_matrix(D, sd, metric_repair='DOMR'),
+                [0.2, 0.3, 0.4, 0.5] * 2))
+        
+        for D_noisy in results:
+            self.assertTrue(_check_metric(D_noisy))
+            
+    
+    def test_wrong_topology_matrix(self):
+        
+        n = 30
+        
+        species_tree = remove_planted_root(te.species_tree_n(n, model='yule'))
+        _, D = distance_matrix(species_tree)
+        D_wrong = te.wrong_topology_matrix(species_tree)
+        
+        self.assertEqual(D_wrong.shape, D.shape)
+        self.assertTrue(_check_metric(D_wrong))
+        
+        # the random tree has the same branch lengths and no path can be
+        # longer than their sum
+        total_length = sum(v.dist for v in species_tree.preorder())
+        self.assertTrue(D_wrong.max() <= total_length + 1e-8)
             
 
 if __name__ == '__main__':
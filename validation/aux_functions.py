@@ -25,13 +25,10 @@ def parse_distance_matrix(filename):
                 row += line.rstrip()
                 line = f.readline()
             
-            row = row.split()
+            label, values = row.split(maxsplit=1)
             
-            labels.append(row[0])
-            
-            for j in range(number):
-                
-                D[i, j] = float(row[j+1])
+            labels.append(label)
+            D[i, :] = np.fromstring(values, sep=' ')
                 
     return D, labels
 
@@ -46,18 +43,11 @@ def rearrange_matrix(D, labels, target_labels):
     if labels == target_labels:
         return np.copy(D)
     
-    mapping = []
-    for i in range(n):
-        mapping.append( labels.index(target_labels[i]) )
-    
-    D_new = np.zeros_like(D)
-    
-    for i in range(n):
-        for j in range(n):
-            
-            D_new[i, j] = D[mapping[i], mapping[j]]
+    position = {label: i for i, label in enumerate(labels)}
+    mapping = np.fromiter((position[label] for label in target_labels),
+                          dtype=np.intp, count=n)
     
-    return D_new
+    return D[np.ix_(mapping, mapping)]
 
 
 def calc_distances(puzzle_path, infile, model='WAG'):